@@ -1,12 +1,21 @@
 import streamlit as st
-import fitz  # PyMuPDF
-# import PyMuPDF  # PyMuPDF
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None  # Reported once by main()
 import re
 import zipfile
-import tempfile
 import os
+import sys
+import gc
+import multiprocessing
 from pathlib import Path
-from collections import defaultdict, OrderedDict
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from collections import defaultdict, namedtuple
+from operator import itemgetter
+import numpy as np
+import pandas as pd
 from pptx import Presentation
 from pptx.util import Inches, Pt
 from pptx.dml.color import RGBColor
@@ -14,6 +23,60 @@ from pptx.enum.text import PP_ALIGN
 import hashlib
 import io
 
+# Precompiled patterns used for every candidate text block / filename
+_DEFECT_CODE_RE = re.compile(r'defect code\s+(\d+)', re.IGNORECASE)
+_DEFECT_SPLIT_RE = re.compile(r'\s+defect', re.IGNORECASE)
+_DEFECT_RE = re.compile(r'defect', re.IGNORECASE)
+_UNDERSCORES_RE = re.compile(r'_{2,}')
+
+# Characters not allowed in file names, replaced in a single str.translate pass
+_ILLEGAL_CHARS_TABLE = str.maketrans({c: '_' for c in '<>:"/\\|?*\n\r\t'})
+
+# Image formats that are already compressed and are stored as-is in the ZIP
+_COMPRESSED_IMAGE_EXTS = {'jpg', 'jpeg', 'png', 'jpx', 'jb2'}
+
+# Image block on a page with the text blocks that follow it
+ImageBlock = namedtuple('ImageBlock', 'bbox y_position text_blocks')
+
+# Run a full garbage collection every N pages of a long PDF
+_GC_PAGE_INTERVAL = 50
+
+# PyMuPDF extraction stops scaling beyond a handful of processes
+_MAX_EXTRACT_WORKERS = 4
+
+# PPT layout constants, computed once instead of on every image page
+_SLIDE_WIDTH = Inches(16)
+_SLIDE_HEIGHT = Inches(9)
+_IMAGE_TOP = Inches(1.8)
+_IMAGE_HEIGHT = Inches(5.38)
+_ORDER_NUMBER_OFFSET = Inches(0.4)
+_ORDER_NUMBER_HEIGHT = Inches(0.3)
+_HEADER_BOX = (Inches(0.5), Inches(0.2), Inches(15), Inches(0.8))
+_PAGE_NUMBER_BOX = (Inches(14.5), Inches(8.2), Inches(1), Inches(0.5))
+_DEFECT_TITLE_BOX = (Inches(1), Inches(2), Inches(14), Inches(3))
+_HEADER_FONT_SIZE = Pt(28)
+_GROUP_FONT_SIZE = Pt(16)
+_ORDER_NUMBER_FONT_SIZE = Pt(20)
+_PAGE_NUMBER_FONT_SIZE = Pt(12)
+_GREY = RGBColor(100, 100, 100)
+_LIGHT_GREY = RGBColor(150, 150, 150)
+_ORDER_NUMBER_COLOR = RGBColor(0, 0, 139)
+
+def _image_positions(count, width, gap):
+    """Positions of `count` images of `width`, centered on the slide with `gap` between them"""
+    start_left = (_SLIDE_WIDTH - (count * width + (count - 1) * gap)) / 2
+    return [
+        (start_left + i * (width + gap), _IMAGE_TOP, width, _IMAGE_HEIGHT)
+        for i in range(count)
+    ]
+
+# Image positions by number of images on the page
+_IMAGE_POSITIONS = {
+    1: _image_positions(1, Inches(8), 0),              # 1 image: centered
+    2: _image_positions(2, Inches(6), Inches(1)),      # 2 images: side by side
+    3: _image_positions(3, Inches(4.78), Inches(0.3)),  # 3 images: horizontal side by side
+}
+
 # Set page configuration
 st.set_page_config(
     page_title="HSE Defect Image Extraction and PPT Generation System",
@@ -21,175 +84,303 @@ st.set_page_config(
     layout="wide"
 )
 
+def _sanitize_filename(filename):
+    """Clean filename"""
+    if not filename:
+        return "unknown"
+    
+    # Remove special characters
+    filename = filename.translate(_ILLEGAL_CHARS_TABLE)
+    
+    # Replace multiple underscores with single
+    filename = _UNDERSCORES_RE.sub('_', filename)
+    
+    # Limit length
+    if len(filename) > 100:
+        filename = filename[:100]
+    
+    return filename.strip()
+
 class PDFDefectExtractor:
     """PDF Defect Extractor Class"""
     def __init__(self):
         self.extracted_items = []
+        # (level, text) pairs; Streamlit can't be called from worker processes,
+        # so messages are collected here and shown by the caller
+        self.messages = []
     
-    def extract_defects_from_pdf(self, pdf_file, filename):
+    def extract_defects_from_pdf(self, pdf_bytes, filename):
         """Extract defect information from a single PDF file"""
         extracted_items = []
+        doc = None
+        # Order number / ZIP folder name, shared by every item of this PDF
+        pdf_stem = Path(filename).stem
         
         try:
-            pdf_bytes = pdf_file.read()
             doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            # Pages often reuse the same xref; decode each image stream only once
+            image_cache = {}
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                blocks = page.get_text("dict")["blocks"]
+            # Hoist lookups used inside the page loop
+            # "blocks" yields flat tuples (x0, y0, x1, y1, text, block_no, block_type)
+            # instead of the full span dicts; image blocks need to be requested explicitly
+            text_flags = fitz.TEXTFLAGS_BLOCKS | fitz.TEXT_PRESERVE_IMAGES
+            extract_image = doc.extract_image
+            analyze_text_blocks = self._analyze_text_blocks
+            
+            for page_num, page in enumerate(doc):
+                if page_num and page_num % _GC_PAGE_INTERVAL == 0:
+                    gc.collect()
+                
+                # Pages without images (covers, text-only pages) can't hold a defect,
+                # so the text extraction is skipped for them
                 image_list = page.get_images(full=True)
+                if not image_list:
+                    continue
+                # One text extraction serves both the "blocks" and the "dict" output
+                textpage = page.get_textpage(flags=text_flags)
+                blocks = page.get_text("blocks", textpage=textpage)
                 
-                # Find all image blocks
-                image_blocks = []
-                for i, block in enumerate(blocks):
-                    if block["type"] == 1:  # Image block
-                        image_blocks.append({
-                            "index": i,
-                            "bbox": block["bbox"],
-                            "y_position": block["bbox"][1]
-                        })
+                # The first image block is always skipped, so a defect needs at least two
+                if sum(1 for block in blocks if block[6] == 1) < 2:
+                    continue
+                
+                # Find all image blocks together with the text blocks following them
+                block_texts = self._get_block_texts(page, textpage)
+                image_blocks = self._collect_image_blocks(blocks, block_texts)
                 
                 # Sort by y-coordinate (top to bottom)
-                image_blocks.sort(key=lambda x: x["y_position"])
+                image_blocks.sort(key=itemgetter(1))  # y_position
                 
-                # Process each image block (skip the first one)
-                for block_idx, block_info in enumerate(image_blocks):
-                    if block_idx == 0:  # Skip the first image
-                        continue
-                    
-                    result = self._analyze_text_blocks(blocks, block_info["index"])
-                    
+                # Analyze each image block (skip the first one)
+                defect_blocks = []
+                for block_info in image_blocks[1:]:
+                    result = analyze_text_blocks(block_info.text_blocks)
                     if result and "defect_code" in result:
-                        # Find the closest image based on block position
-                        bbox = block_info["bbox"]
-                        matched_image_idx = self._find_matching_image(page, bbox, image_list)
-                        
+                        defect_blocks.append((block_info.bbox, result))
+                
+                if defect_blocks:
+                    # Find the closest image for all defect blocks of the page at once
+                    img_centers = self._get_image_centers(page, image_list)
+                    matched_indices = self._find_matching_images(
+                        [bbox for bbox, _ in defect_blocks], img_centers)
+                    
+                    for (bbox, result), matched_image_idx in zip(defect_blocks, matched_indices):
                         if matched_image_idx is not None:
                             try:
                                 xref = image_list[matched_image_idx][0]
-                                base_image = doc.extract_image(xref)
+                                base_image = image_cache.get(xref)
+                                if base_image is None:
+                                    base_image = image_cache[xref] = extract_image(xref)
+                                    # Content hash lets identical images from other PDFs be shared
+                                    base_image["sha256"] = hashlib.sha256(base_image["image"]).hexdigest()
                                 
                                 # Clean defect reason for filename
                                 reason = result.get("reason", f"defect_{result['defect_code']}")
-                                clean_reason = self._sanitize_filename(reason)
+                                clean_reason = _sanitize_filename(reason)
                                 
                                 if not clean_reason or clean_reason == "_":
                                     clean_reason = f"defect_{result['defect_code']}"
                                 
                                 extracted_items.append({
                                     "pdf_name": filename,
+                                    "pdf_stem": pdf_stem,
                                     "page": page_num + 1,
                                     "defect_code": result.get("defect_code", ""),
                                     "reason": reason,
                                     "clean_reason": clean_reason,
                                     "image_data": base_image["image"],
-                                    "image_ext": base_image["ext"]
+                                    "image_ext": base_image["ext"],
+                                    "image_sha": base_image["sha256"]
                                 })
                                 
                             except Exception as e:
-                                st.warning(f"Failed to extract image: {e}")
+                                self.messages.append(("warning", f"Failed to extract image: {e}"))
                                 continue
-            
-            doc.close()
+                
+                # Release this page's objects and empty the MuPDF resource store,
+                # otherwise cached fonts/images keep growing with the page count
+                page = textpage = blocks = block_texts = image_list = image_blocks = defect_blocks = None
+                fitz.TOOLS.store_shrink(100)
         except Exception as e:
-            st.error(f"Error processing PDF file {filename}: {str(e)}")
+            self.messages.append(("error", f"Error processing PDF file {filename}: {str(e)}"))
+        finally:
+            # Close the document even when a page fails half-way
+            if doc is not None:
+                doc.close()
         
         return extracted_items
     
-    def _analyze_text_blocks(self, blocks, start_index):
+    def _collect_image_blocks(self, blocks, block_texts):
+        """Collect image blocks and up to 6 following text blocks in one pass"""
+        image_blocks = []
+        pending = []  # Image blocks still collecting text
+        
+        for block in blocks:
+            block_type = block[6]
+            if block_type == 1:  # Image block
+                image_block = ImageBlock(block[:4], block[1], [])
+                image_blocks.append(image_block)
+                pending.append(image_block)
+            elif block_type == 0 and pending:  # Text block
+                text = block_texts.get(block[5])
+                if not text:
+                    continue
+                
+                still_pending = []
+                has_code = None
+                for image_block in pending:
+                    text_blocks = image_block.text_blocks
+                    text_blocks.append(text)
+                    
+                    # The 5th text block must contain the defect code,
+                    # otherwise stop collecting for this image right away
+                    if len(text_blocks) == 5:
+                        if has_code is None:
+                            has_code = _DEFECT_CODE_RE.search(text) is not None
+                        if not has_code:
+                            continue
+                    
+                    if len(text_blocks) < 6:
+                        still_pending.append(image_block)
+                pending = still_pending
+        
+        return image_blocks
+    
+    def _analyze_text_blocks(self, text_blocks):
         """Analyze the 6 text blocks following an image block"""
         result = {}
-        text_blocks = []
-        current_index = start_index + 1
-        
-        while len(text_blocks) < 6 and current_index < len(blocks):
-            block = blocks[current_index]
-            if block["type"] == 0:  # Text block
-                text = self._extract_text_from_block(block)
-                if text.strip():
-                    text_blocks.append(text)
-            current_index += 1
         
         if len(text_blocks) < 6:
             return None
         
-        # Check the 5th text block
-        if "defect code" not in text_blocks[4].lower():
-            return None
-        
         # Extract defect code
-        code_match = re.search(r'defect code\s+(\d+)', text_blocks[4], re.IGNORECASE)
+        code_match = _DEFECT_CODE_RE.search(text_blocks[4])
         if not code_match:
             return None
         
         result["defect_code"] = code_match.group(1)
         
-        # Extract reason
-        if "defect" in text_blocks[5].lower():
-            parts = re.split(r'\s+defect', text_blocks[5], flags=re.IGNORECASE)
-            if parts and parts[0].strip():
-                result["reason"] = parts[0].strip()
-            else:
-                return None
+        # Extract reason: everything before the first "<whitespace>defect";
+        # without that separator the block must still mention "defect" at all
+        split_match = _DEFECT_SPLIT_RE.search(text_blocks[5])
+        if split_match:
+            reason = text_blocks[5][:split_match.start()]
+        elif _DEFECT_RE.search(text_blocks[5]):
+            reason = text_blocks[5]
         else:
             return None
+        if not reason.strip():
+            return None
+        
+        result["reason"] = reason.strip()
         
         return result
     
-    def _find_matching_image(self, page, bbox, image_list):
-        """Find matching image"""
-        block_center_x = (bbox[0] + bbox[2]) / 2
-        block_center_y = (bbox[1] + bbox[3]) / 2
-        
-        best_match_idx = None
-        min_distance = float('inf')
-        
+    def _get_image_centers(self, page, image_list):
+        """Get image indices and center x/y arrays of the placed images on the page"""
+        img_indices, img_cx, img_cy = [], [], []
         for img_idx, img_info in enumerate(image_list):
             xref = img_info[0]
             img_rects = page.get_image_rects(xref)
             
             if img_rects:
                 img_rect = img_rects[0]
-                img_center_x = (img_rect.x0 + img_rect.x1) / 2
-                img_center_y = (img_rect.y0 + img_rect.y1) / 2
-                
-                distance = ((img_center_x - block_center_x) ** 2 + 
-                           (img_center_y - block_center_y) ** 2) ** 0.5
-                
-                if distance < min_distance:
-                    min_distance = distance
-                    best_match_idx = img_idx
+                img_indices.append(img_idx)
+                img_cx.append((img_rect.x0 + img_rect.x1) / 2)
+                img_cy.append((img_rect.y0 + img_rect.y1) / 2)
         
-        return best_match_idx
+        return np.array(img_indices), np.array(img_cx), np.array(img_cy)
+    
+    def _find_matching_images(self, bboxes, img_centers):
+        """Find the matching image index for each block bbox"""
+        img_indices, img_cx, img_cy = img_centers
+        if not len(img_indices):
+            return [None] * len(bboxes)
+        
+        bboxes = np.asarray(bboxes, dtype=float)
+        block_cx = (bboxes[:, 0] + bboxes[:, 2]) / 2
+        block_cy = (bboxes[:, 1] + bboxes[:, 3]) / 2
+        
+        # Squared distance of every block to every image, nearest image per row;
+        # the sqrt is skipped as it doesn't change the nearest image
+        dx = img_cx[None, :] - block_cx[:, None]
+        dy = img_cy[None, :] - block_cy[:, None]
+        best = np.argmin(dx * dx + dy * dy, axis=1)
+        return [int(idx) for idx in img_indices[best]]
+    
+    def _get_block_texts(self, page, textpage):
+        """Map the block numbers of the page's text blocks to their text"""
+        # The "blocks" text glues spans of a line together without a separator
+        # ("Defect Code" + "103" -> "Defect Code103"), so the text is rebuilt from the spans
+        return {
+            block["number"]: self._extract_text_from_block(block)
+            for block in page.get_text("dict", textpage=textpage)["blocks"]
+            if block["type"] == 0
+        }
     
     def _extract_text_from_block(self, block):
         """Extract text from text block"""
-        text = ""
-        if "lines" in block:
-            for line in block["lines"]:
-                if "spans" in line:
-                    for span in line["spans"]:
-                        text += span.get("text", "") + " "
-        return text.strip()
-    
-    def _sanitize_filename(self, filename):
-        """Clean filename"""
-        if not filename:
-            return "unknown"
-        
-        # Remove special characters
-        illegal_chars = ['<', '>', ':', '"', '/', '\\', '|', '?', '*', '\n', '\r', '\t']
-        for char in illegal_chars:
-            filename = filename.replace(char, '_')
-        
-        # Replace multiple underscores with single
-        filename = re.sub(r'_{2,}', '_', filename)
-        
-        # Limit length
-        if len(filename) > 100:
-            filename = filename[:100]
-        
-        return filename.strip()
+        return " ".join(span["text"] for line in block["lines"] for span in line["spans"]).strip()
+
+def _extract_pdf_worker(pdf_bytes, filename):
+    """Extract one PDF in a worker process, returning items and messages"""
+    extractor = PDFDefectExtractor()
+    defects = extractor.extract_defects_from_pdf(pdf_bytes, filename)
+    return defects, extractor.messages
+
+def _create_extract_executor(job_count):
+    """Create the executor used to extract uploaded PDFs in parallel"""
+    max_workers = max(1, min(os.cpu_count() or 1, _MAX_EXTRACT_WORKERS, job_count))
+    
+    # Workers must be forked: Streamlit runs this script as a synthetic __main__
+    # module that spawned processes cannot re-import (Windows, macOS default)
+    if sys.platform.startswith("linux"):
+        try:
+            return ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=multiprocessing.get_context("fork")
+            )
+        except (OSError, ImportError, NotImplementedError):
+            pass  # e.g. no /dev/shm for the pool's semaphores
+    
+    # PyMuPDF is not thread-safe and the MuPDF store is process-global,
+    # so without worker processes the PDFs are extracted one at a time
+    return ThreadPoolExecutor(max_workers=1)
+
+def _create_images_zip(all_defects):
+    """Create the ZIP of all extracted images, one folder per PDF file"""
+    # Create ZIP file in memory; already-compressed images are stored,
+    # anything else (e.g. bmp/tiff/pnm) gets a fast deflate
+    zip_buffer = io.BytesIO()
+    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+        # Create folders by PDF file
+        file_counter = defaultdict(int)
+        
+        for defect in all_defects:
+            pdf_name = defect['pdf_stem']
+            reason = defect['clean_reason']
+            
+            # Handle duplicate filenames
+            file_counter[(pdf_name, reason)] += 1
+            count = file_counter[(pdf_name, reason)]
+            
+            if count == 1:
+                filename = f"{reason}.{defect['image_ext']}"
+            else:
+                filename = f"{reason}_{count}.{defect['image_ext']}"
+            
+            # Full ZIP path
+            zip_path = f"{pdf_name}/{filename}"
+            
+            # Add to ZIP
+            if defect['image_ext'].lower() in _COMPRESSED_IMAGE_EXTS:
+                zip_file.writestr(zip_path, defect['image_data'])
+            else:
+                zip_file.writestr(zip_path, defect['image_data'],
+                                  compress_type=zipfile.ZIP_DEFLATED, compresslevel=1)
+    
+    return zip_buffer.getvalue()
 
 class PPTCreator:
     """PPT Generator Class"""
@@ -202,35 +393,17 @@ class PPTCreator:
             return None
         
         # Categorize images by defect reason
-        defects_by_reason = OrderedDict()
-        file_counter = defaultdict(int)
+        defects_by_reason = defaultdict(list)
         
         for defect in all_defects:
-            reason = defect['reason']
-            clean_reason = self._sanitize_filename(reason)
-            
-            if not clean_reason or clean_reason == "_":
-                clean_reason = f"defect_{defect.get('defect_code', 'unknown')}"
-            
-            # Handle duplicate filenames
-            file_counter[clean_reason] += 1
-            count = file_counter[clean_reason]
-            
-            if count > 1:
-                clean_reason = f"{clean_reason}_{count}"
-            
-            if reason not in defects_by_reason:
-                defects_by_reason[reason] = []
-            
-            defects_by_reason[reason].append({
-                'order_number': defect.get('pdf_name', 'unknown').replace('.pdf', ''),
+            defects_by_reason[defect['reason']].append({
+                'order_number': defect.get('pdf_stem', 'unknown'),
                 'image_data': defect['image_data'],
-                'image_ext': defect['image_ext'],
-                'clean_name': clean_reason
+                'image_ext': defect['image_ext']
             })
         
         # Sort by defect reason name
-        defects_by_reason = OrderedDict(sorted(defects_by_reason.items()))
+        defects_by_reason = dict(sorted(defects_by_reason.items()))
         
         # Create PPT
         return self._create_pptx_by_defect_reason(defects_by_reason, ppt_name)
@@ -242,8 +415,8 @@ class PPTCreator:
             prs = Presentation()
             
             # Set slide size (16:9)
-            prs.slide_width = Inches(16)
-            prs.slide_height = Inches(9)
+            prs.slide_width = _SLIDE_WIDTH
+            prs.slide_height = _SLIDE_HEIGHT
             
             # Add title page
             self._add_title_page(prs, len(defects_by_reason), 
@@ -337,12 +510,7 @@ class PPTCreator:
         slide = prs.slides.add_slide(blank_slide_layout)
         
         # Add title
-        left = Inches(1)
-        top = Inches(2)
-        width = Inches(14)
-        height = Inches(3)
-        
-        title_box = slide.shapes.add_textbox(left, top, width, height)
+        title_box = slide.shapes.add_textbox(*_DEFECT_TITLE_BOX)
         title_frame = title_box.text_frame
         
         # Add defect type title
@@ -356,7 +524,7 @@ class PPTCreator:
         p = title_frame.add_paragraph()
         p.text = f"Defect Type {defect_index} of {total_defects}"
         p.font.size = Pt(24)
-        p.font.color.rgb = RGBColor(100, 100, 100)
+        p.font.color.rgb = _GREY
         p.alignment = PP_ALIGN.CENTER
     
     def _add_defect_images_page(self, prs, defect_reason, img_group, group_number, total_groups):
@@ -375,26 +543,21 @@ class PPTCreator:
     
     def _add_defect_header(self, slide, defect_reason, group_number, total_groups):
         """Add header: defect reason"""
-        left = Inches(0.5)
-        top = Inches(0.2)
-        width = Inches(15)
-        height = Inches(0.8)
-        
-        header_box = slide.shapes.add_textbox(left, top, width, height)
+        header_box = slide.shapes.add_textbox(*_HEADER_BOX)
         header_frame = header_box.text_frame
         
         # Add defect reason
         p = header_frame.paragraphs[0]
         p.text = f"Defect Reason: {defect_reason}"
-        p.font.size = Pt(28)
+        p.font.size = _HEADER_FONT_SIZE
         p.font.bold = True
         
         # Add group info (if needed)
         if total_groups > 1:
             p = header_frame.add_paragraph()
             p.text = f"Group {group_number} of {total_groups}"
-            p.font.size = Pt(16)
-            p.font.color.rgb = RGBColor(100, 100, 100)
+            p.font.size = _GROUP_FONT_SIZE
+            p.font.color.rgb = _GREY
     
     def _add_images_with_order_numbers(self, slide, img_group):
         """Add images and order numbers"""
@@ -403,89 +566,40 @@ class PPTCreator:
             return
         
         # Set different layouts based on image count
-        if img_count == 1:
-            # 1 image: centered
-            width = Inches(8)
-            height = Inches(5.38)
-            left = (Inches(16) - width) / 2
-            top = Inches(1.8)
-            
-            positions = [(left, top, width, height)]
-            
-        elif img_count == 2:
-            # 2 images: side by side
-            width = Inches(6)
-            height = Inches(5.38)
-            total_width = 2 * width + Inches(1)
-            start_left = (Inches(16) - total_width) / 2
-            top = Inches(1.8)
-            
-            positions = [
-                (start_left, top, width, height),
-                (start_left + width + Inches(1), top, width, height)
-            ]
-            
-        else:  # img_count == 3
-            # 3 images: horizontal side by side, using new dimensions
-            width = Inches(4.78)
-            height = Inches(5.38)
-            
-            total_width = 3 * width + Inches(2 * 0.3)
-            start_left = (Inches(16) - total_width) / 2
-            top = Inches(1.8)
-            
-            positions = [
-                (start_left, top, width, height),
-                (start_left + width + Inches(0.3), top, width, height),
-                (start_left + 2 * (width + Inches(0.3)), top, width, height)
-            ]
+        positions = _IMAGE_POSITIONS[min(img_count, 3)]
         
         # Add images and order numbers
         for i, (img_info, (left, top, width, height)) in enumerate(zip(img_group, positions)):
             try:
-                # Save image to temporary file
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{img_info['image_ext']}") as tmp_file:
-                    tmp_file.write(img_info['image_data'])
-                    tmp_file_path = tmp_file.name
-                
                 # Add order number (above image)
-                self._add_order_number(slide, img_info['order_number'], left, top - Inches(0.4), width)
+                self._add_order_number(slide, img_info['order_number'], left, top - _ORDER_NUMBER_OFFSET, width)
                 
-                # Add image
-                slide.shapes.add_picture(tmp_file_path, left, top, width=width, height=height)
-                
-                # Delete temporary file
-                os.unlink(tmp_file_path)
+                # Add image straight from memory
+                image_stream = io.BytesIO(img_info['image_data'])
+                slide.shapes.add_picture(image_stream, left, top, width=width, height=height)
                 
             except Exception as e:
                 st.warning(f"Failed to add image: {e}")
     
     def _add_order_number(self, slide, order_number, left, top, width):
         """Add order number label"""
-        height = Inches(0.3)
-        
-        textbox = slide.shapes.add_textbox(left, top, width, height)
+        textbox = slide.shapes.add_textbox(left, top, width, _ORDER_NUMBER_HEIGHT)
         text_frame = textbox.text_frame
         
         text_frame.text = f"Order No: {order_number}"
-        text_frame.paragraphs[0].font.size = Pt(20)
+        text_frame.paragraphs[0].font.size = _ORDER_NUMBER_FONT_SIZE
         text_frame.paragraphs[0].font.bold = True
-        text_frame.paragraphs[0].font.color.rgb = RGBColor(0, 0, 139)
+        text_frame.paragraphs[0].font.color.rgb = _ORDER_NUMBER_COLOR
         text_frame.paragraphs[0].alignment = PP_ALIGN.CENTER
     
     def _add_page_number(self, slide, current_group, total_groups):
         """Add page number"""
-        left = Inches(14.5)
-        top = Inches(8.2)
-        width = Inches(1)
-        height = Inches(0.5)
-        
-        textbox = slide.shapes.add_textbox(left, top, width, height)
+        textbox = slide.shapes.add_textbox(*_PAGE_NUMBER_BOX)
         text_frame = textbox.text_frame
         
         text_frame.text = f"{current_group}/{total_groups}"
-        text_frame.paragraphs[0].font.size = Pt(12)
-        text_frame.paragraphs[0].font.color.rgb = RGBColor(150, 150, 150)
+        text_frame.paragraphs[0].font.size = _PAGE_NUMBER_FONT_SIZE
+        text_frame.paragraphs[0].font.color.rgb = _LIGHT_GREY
         text_frame.paragraphs[0].alignment = PP_ALIGN.RIGHT
     
     def _add_ending_page(self, prs):
@@ -511,29 +625,12 @@ class PPTCreator:
         p = text_frame.add_paragraph()
         p.text = "Quality Control Department"
         p.font.size = Pt(24)
-        p.font.color.rgb = RGBColor(100, 100, 100)
+        p.font.color.rgb = _GREY
         p.alignment = PP_ALIGN.CENTER
     
     def _get_current_date(self):
         """Get current date"""
-        from datetime import datetime
         return datetime.now().strftime("%Y-%m-%d")
-    
-    def _sanitize_filename(self, filename):
-        """Clean filename"""
-        if not filename:
-            return "unknown"
-        
-        illegal_chars = ['<', '>', ':', '"', '/', '\\', '|', '?', '*', '\n', '\r', '\t']
-        for char in illegal_chars:
-            filename = filename.replace(char, '_')
-        
-        filename = re.sub(r'_{2,}', '_', filename)
-        
-        if len(filename) > 100:
-            filename = filename[:100]
-        
-        return filename.strip()
 
 def main():
     """Main application function"""
@@ -546,6 +643,11 @@ def main():
     4. **Download results**: Download extracted images and generated PPT
     """)
     
+    # Fail fast instead of queuing extraction jobs that can't run
+    if fitz is None:
+        st.error("PyMuPDF is not installed, add 'pymupdf' to requirements.txt")
+        st.stop()
+    
     # Create two main function tabs
     tab1, tab2 = st.tabs(["📄 PDF Defect Extraction", "📊 PPT Generation"])
     
@@ -559,7 +661,6 @@ def main():
         )
         
         if uploaded_files:
-            extractor = PDFDefectExtractor()
             all_defects = []
             
             # Progress bar
@@ -567,18 +668,62 @@ def main():
             status_text = st.empty()
             
             with st.spinner("Processing PDF files..."):
-                for i, uploaded_file in enumerate(uploaded_files):
-                    # Update progress
-                    progress = (i) / len(uploaded_files)
-                    progress_bar.progress(progress)
-                    status_text.text(f"Processing: {uploaded_file.name} ({i+1}/{len(uploaded_files)})")
+                # Every widget change reruns the script with the same uploads, so results
+                # are kept in the session keyed by file name and content hash
+                extraction_cache = st.session_state.setdefault('extraction_cache', {})
+                # An upload keeps its file_id across reruns, so each file is hashed only once
+                upload_hashes = st.session_state.setdefault('upload_hashes', {})
+                cache_keys = []
+                for uploaded_file in uploaded_files:
+                    file_hash = upload_hashes.get(uploaded_file.file_id)
+                    if file_hash is None:
+                        file_hash = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+                        upload_hashes[uploaded_file.file_id] = file_hash
+                    cache_keys.append((uploaded_file.name, file_hash))
+                results = [extraction_cache.get(key) for key in cache_keys]
+                pending = [i for i, result in enumerate(results) if result is None]
+                
+                if pending:
+                    # PDFs are independent and CPU-bound in MuPDF, so extract them in parallel
+                    with _create_extract_executor(len(pending)) as executor:
+                        futures = {
+                            executor.submit(_extract_pdf_worker, uploaded_files[i].getvalue(), uploaded_files[i].name): i
+                            for i in pending
+                        }
+                        
+                        for done, future in enumerate(as_completed(futures), 1):
+                            i = futures[future]
+                            results[i] = extraction_cache[cache_keys[i]] = future.result()
+                            
+                            # Update progress
+                            progress_bar.progress(done / len(pending))
+                            status_text.text(f"Processed: {uploaded_files[i].name} ({done}/{len(pending)})")
+                
+                # Forget files that are no longer uploaded
+                for key in set(extraction_cache) - set(cache_keys):
+                    del extraction_cache[key]
+                for file_id in set(upload_hashes) - {f.file_id for f in uploaded_files}:
+                    del upload_hashes[file_id]
+                
+                # Collect defects in upload order; identical images from different
+                # PDFs share one bytes object in the session instead of one copy each
+                images_by_sha = {}
+                messages_by_level = defaultdict(list)
+                for uploaded_file, (defects, messages) in zip(uploaded_files, results):
+                    for level, message in messages:
+                        messages_by_level[level].append(message)
                     
-                    # Extract defects
-                    defects = extractor.extract_defects_from_pdf(uploaded_file, uploaded_file.name)
                     for defect in defects:
                         defect['pdf_file'] = uploaded_file.name
+                        defect['image_data'] = images_by_sha.setdefault(defect['image_sha'], defect['image_data'])
                         all_defects.append(defect)
                 
+                # One element per level instead of one per message
+                if messages_by_level["error"]:
+                    st.error("\n\n".join(messages_by_level["error"]))
+                if messages_by_level["warning"]:
+                    st.warning("\n\n".join(messages_by_level["warning"]))
+                
                 progress_bar.progress(1.0)
                 status_text.text("Processing complete!")
             
@@ -593,7 +738,7 @@ def main():
                     st.metric("Total Defects", len(all_defects))
                 with col3:
                     # Count defect types
-                    defect_types = len(set(d['reason'] for d in all_defects))
+                    defect_types = len({d['reason'] for d in all_defects})
                     st.metric("Defect Types", defect_types)
                 
                 # Display defect details table
@@ -613,41 +758,20 @@ def main():
                 # Create ZIP file for download
                 st.subheader("📥 Download Extracted Images")
                 
-                with tempfile.TemporaryDirectory() as tmpdir:
-                    # Create ZIP file
-                    zip_buffer = io.BytesIO()
-                    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-                        # Create folders by PDF file
-                        file_counter = defaultdict(int)
-                        
-                        for defect in all_defects:
-                            pdf_name = Path(defect['pdf_name']).stem
-                            reason = defect['clean_reason']
-                            
-                            # Handle duplicate filenames
-                            file_counter[(pdf_name, reason)] += 1
-                            count = file_counter[(pdf_name, reason)]
-                            
-                            if count == 1:
-                                filename = f"{reason}.{defect['image_ext']}"
-                            else:
-                                filename = f"{reason}_{count}.{defect['image_ext']}"
-                            
-                            # Full ZIP path
-                            zip_path = f"{pdf_name}/{filename}"
-                            
-                            # Add to ZIP
-                            zip_file.writestr(zip_path, defect['image_data'])
-                    
-                    # Create download button
-                    zip_buffer.seek(0)
-                    st.download_button(
-                        label="📦 Download All Images (ZIP Format)",
-                        data=zip_buffer,
-                        file_name="extracted_defect_images.zip",
-                        mime="application/zip",
-                        help="Click to download ZIP file containing all extracted images"
-                    )
+                # Widget changes rerun the script; rebuild the ZIP only when the uploads change
+                zip_key = tuple(cache_keys)
+                zip_cache = st.session_state.get('zip_cache')
+                if zip_cache is None or zip_cache[0] != zip_key:
+                    zip_cache = st.session_state['zip_cache'] = (zip_key, _create_images_zip(all_defects))
+                
+                # Create download button
+                st.download_button(
+                    label="📦 Download All Images (ZIP Format)",
+                    data=zip_cache[1],
+                    file_name="extracted_defect_images.zip",
+                    mime="application/zip",
+                    help="Click to download ZIP file containing all extracted images"
+                )
                 
                 # Preview some images
                 st.subheader("🖼️ Image Preview")
@@ -713,20 +837,20 @@ def main():
                     # Display PPT statistics
                     st.subheader("📊 PPT Report Statistics")
                     
-                    # Count defect types
-                    defects_by_reason = defaultdict(list)
-                    for defect in st.session_state.extracted_defects:
-                        defects_by_reason[defect['reason']].append(defect)
-                    
-                    stats_data = []
-                    for reason, defects in sorted(defects_by_reason.items()):
-                        stats_data.append({
-                            "Defect Reason": reason,
-                            "Image Count": len(defects),
-                            "Involved PDF Files": len(set(d['pdf_name'] for d in defects))
-                        })
+                    # Count defect types (groupby sorts by reason)
+                    defects_df = pd.DataFrame(
+                        st.session_state.extracted_defects, columns=['reason', 'pdf_name']
+                    )
+                    stats_df = (
+                        defects_df.groupby('reason')['pdf_name']
+                        .agg(['size', 'nunique'])
+                        .rename(columns={'size': "Image Count", 'nunique': "Involved PDF Files"})
+                        .rename_axis("Defect Reason")
+                        .reset_index()
+                    )
                     
-                    st.dataframe(stats_data, use_container_width=True)
+                    st.dataframe(stats_df, use_container_width=True)
+                    st.bar_chart(stats_df.set_index("Defect Reason")["Image Count"])
                 else:
                     st.error("❌ PPT generation failed")
 